@@ -3,58 +3,72 @@ Simple file-based cache that stores each entry as an individual file.
 
 This module is intended to be copied into your project and modified as needed.
 You may want to customize the serialize/deserialize functions for your use case
-(e.g., use pickle for Python objects, msgpack for performance, etc.).
+(e.g., use pickle for Python objects, JSON for human-readable files, etc.).
 
 Dependencies:
-- aiofiles (for async operations): pip install aiofiles
+- msgspec (for serialization): pip install msgspec
+- blake3 (optional, faster key hashing): pip install blake3
 """
 
+import asyncio
 import hashlib
-import json
+import mmap
+import os
+import threading
 import warnings
 from pathlib import Path
-from typing import TYPE_CHECKING, Any, TypeVar
+from typing import Any, TypeVar
 
-# Optional import for async operations
+import msgspec
+
+# Optional import for faster key hashing (falls back to hashlib.sha256)
 try:
-    import aiofiles
+    from blake3 import blake3
 except ImportError:
-    aiofiles = None  # type: ignore[assignment]
-
-if TYPE_CHECKING:
-    import aiofiles
+    blake3 = None  # type: ignore[assignment]
 
 T = TypeVar("T")
 
+# Hex characters kept from the key digest (128 bits)
+KEY_HASH_LENGTH = 32
+
+# Leading hex characters of the key digest used as the shard subdirectory name
+SHARD_PREFIX_LENGTH = 2
+
 
 # =============================================================================
 # Serialization functions - modify these for your use case
 # =============================================================================
 
-def serialize(value: Any, *, deterministic: bool = False) -> str:
+# Shared codec instances, so per-call encoder/decoder setup is skipped
+_encoder = msgspec.msgpack.Encoder()
+_deterministic_encoder = msgspec.msgpack.Encoder(order="deterministic")
+_decoder = msgspec.msgpack.Decoder()
+
+def serialize(value: Any, *, deterministic: bool = False) -> bytes:
     """
-    Serialize a value to a string.
+    Serialize a value to bytes.
 
     Args:
-        value: The value to serialize (must be JSON-serializable by default).
+        value: The value to serialize (must be msgpack-serializable by default).
         deterministic: If True, use sorted keys for consistent output.
                        Useful when the serialized output is used for hashing.
 
     Returns:
-        The serialized string representation.
+        The serialized MessagePack bytes.
 
     Note:
-        Modify this function if you need different serialization (e.g., pickle, msgpack).
+        Modify this function if you need different serialization (e.g., pickle, JSON).
     """
-    return json.dumps(value, sort_keys=deterministic)
+    return (_deterministic_encoder if deterministic else _encoder).encode(value)
 
 
-def deserialize(data: str) -> Any:
+def deserialize(data: bytes) -> Any:
     """
-    Deserialize a string back to a value.
+    Deserialize bytes back to a value.
 
     Args:
-        data: The serialized string.
+        data: The serialized bytes.
 
     Returns:
         The deserialized value.
@@ -62,7 +76,7 @@ def deserialize(data: str) -> Any:
     Note:
         Modify this function to match your serialize() implementation.
     """
-    return json.loads(data)
+    return _decoder.decode(data)
 
 
 # =============================================================================
@@ -74,6 +88,11 @@ class FileCache:
     A simple file-based cache that stores each entry in a separate file.
 
     Keys are hashed to create filenames, values are serialized to file contents.
+    Files are sharded into subdirectories named after the first two hex
+    characters of the hash, so no single directory grows too large.
+    The hashes of entries on disk are indexed in memory when the cache is
+    created, so lookups of missing keys never touch the filesystem. Entries
+    written to the directory by other processes after that are not seen by get().
 
     Example:
         cache = FileCache("./my_cache")
@@ -90,12 +109,47 @@ class FileCache:
         """
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._shards: set[str] = set()
+        self._hash_set: set[str] = set()
+        with os.scandir(self.cache_dir) as shards:
+            for shard in shards:
+                if len(shard.name) != SHARD_PREFIX_LENGTH or not shard.is_dir():
+                    continue
+                self._shards.add(shard.name)
+                with os.scandir(shard.path) as entries:
+                    self._hash_set.update(
+                        shard.name + entry.name.removesuffix(".cache")
+                        for entry in entries
+                        if entry.name.endswith(".cache")
+                    )
+
+    def hash_key(self, key: Any) -> str:
+        """Hash the serialized form of a key to the hex string used in its filename."""
+        key_bytes = serialize(key, deterministic=True)
+        if blake3 is not None:
+            return blake3(key_bytes).hexdigest(length=KEY_HASH_LENGTH // 2)
+        return hashlib.sha256(key_bytes, usedforsecurity=False).hexdigest()[:KEY_HASH_LENGTH]
+
+    def _hash_to_filename(self, key_hash: str) -> Path:
+        """Convert a key hash to its cache file path inside its shard directory."""
+        shard = key_hash[:SHARD_PREFIX_LENGTH]
+        return self.cache_dir / shard / f"{key_hash[SHARD_PREFIX_LENGTH:]}.cache"
 
     def _key_to_filename(self, key: Any) -> Path:
         """Convert a key to a cache file path by hashing its serialized form."""
-        key_str = serialize(key, deterministic=True)
-        key_hash = hashlib.sha256(key_str.encode()).hexdigest()
-        return self.cache_dir / f"{key_hash}.cache"
+        return self._hash_to_filename(self.hash_key(key))
+
+    def _read_file(self, filepath: Path) -> Any:
+        """Read and deserialize a cache file, memory-mapping it unless it fits in a page."""
+        fd = os.open(filepath, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            if size < mmap.PAGESIZE:
+                return deserialize(os.read(fd, size))
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                return deserialize(view)
+        finally:
+            os.close(fd)
 
     def get(self, key: Any, default: T = None) -> Any | T:
         """
@@ -108,12 +162,23 @@ class FileCache:
         Returns:
             The cached value, or default if not found.
         """
-        filepath = self._key_to_filename(key)
-        if not filepath.exists():
+        return self.get_by_hash(self.hash_key(key), default)
+
+    def get_by_hash(self, key_hash: str, default: T = None) -> Any | T:
+        """
+        Retrieve a value from the cache by a hash from hash_key().
+
+        Use this with set_by_hash() to avoid hashing a large key twice.
+        """
+        if key_hash not in self._hash_set:
             return default
 
-        with open(filepath, "r", encoding="utf-8") as f:
-            return deserialize(f.read())
+        try:
+            return self._read_file(self._hash_to_filename(key_hash))
+        except FileNotFoundError:
+            # Removed from disk since the index was built
+            self._hash_set.discard(key_hash)
+            return default
 
     def set(self, key: Any, value: Any) -> None:
         """
@@ -123,9 +188,34 @@ class FileCache:
             key: The cache key (must be serializable).
             value: The value to cache (must be serializable).
         """
-        filepath = self._key_to_filename(key)
-        with open(filepath, "w", encoding="utf-8") as f:
-            f.write(serialize(value))
+        self.set_by_hash(self.hash_key(key), value)
+
+    def set_by_hash(self, key_hash: str, value: Any) -> None:
+        """
+        Store a value in the cache by a hash from hash_key().
+
+        The entry is written to a temporary file and atomically renamed into
+        place, so readers never see a partially written entry.
+        """
+        filepath = self._hash_to_filename(key_hash)
+        tmp_path = filepath.with_suffix(f".cache.tmp.{os.getpid()}.{threading.get_ident()}")
+        data = memoryview(serialize(value))
+        shard = key_hash[:SHARD_PREFIX_LENGTH]
+        if shard not in self._shards:
+            filepath.parent.mkdir(exist_ok=True)
+            self._shards.add(shard)
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+            try:
+                while data:
+                    data = data[os.write(fd, data):]
+            finally:
+                os.close(fd)
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        self._hash_set.add(key_hash)
 
     def delete(self, key: Any) -> bool:
         """
@@ -137,31 +227,34 @@ class FileCache:
         Returns:
             True if the entry was deleted, False if it didn't exist.
         """
-        filepath = self._key_to_filename(key)
-        if filepath.exists():
-            filepath.unlink()
-            return True
-        return False
+        key_hash = self.hash_key(key)
+        self._hash_set.discard(key_hash)
+        try:
+            os.unlink(self._hash_to_filename(key_hash))
+        except FileNotFoundError:
+            return False
+        return True
 
     def exists(self, key: Any) -> bool:
         """Check if a key exists in the cache."""
-        return self._key_to_filename(key).exists()
+        return os.path.lexists(self._key_to_filename(key))
 
     def clear(self) -> int:
         """
         Clear all entries from the cache.
 
         Warning:
-            This deletes ALL .cache files in the cache directory. If you're
+            This deletes ALL .cache files under the cache directory. If you're
             sharing the directory with other caches, they will also be cleared.
 
         Returns:
             Number of entries deleted.
         """
         count = 0
-        for filepath in self.cache_dir.glob("*.cache"):
+        for filepath in self.cache_dir.rglob("*.cache"):
             filepath.unlink()
             count += 1
+        self._hash_set.clear()
         if count > 0:
             warnings.warn(
                 f"Cleared {count} cache entries from {self.cache_dir}",
@@ -170,38 +263,24 @@ class FileCache:
         return count
 
     # =========================================================================
-    # Async methods (require aiofiles)
+    # Async methods (run the sync implementation in a worker thread)
     # =========================================================================
 
     async def aget(self, key: Any, default: T = None) -> Any | T:
         """
         Async version of get().
 
-        Requires: pip install aiofiles
+        Note: Runs the whole sync lookup in a worker thread.
         """
-        if aiofiles is None:
-            raise ImportError("aiofiles is required for async operations: pip install aiofiles")
-
-        filepath = self._key_to_filename(key)
-        if not filepath.exists():
-            return default
-
-        async with aiofiles.open(filepath, "r", encoding="utf-8") as f:
-            content = await f.read()
-            return deserialize(content)
+        return await asyncio.to_thread(self.get, key, default)
 
     async def aset(self, key: Any, value: Any) -> None:
         """
         Async version of set().
 
-        Requires: pip install aiofiles
+        Note: Runs the whole sync write in a worker thread.
         """
-        if aiofiles is None:
-            raise ImportError("aiofiles is required for async operations: pip install aiofiles")
-
-        filepath = self._key_to_filename(key)
-        async with aiofiles.open(filepath, "w", encoding="utf-8") as f:
-            await f.write(serialize(value))
+        await asyncio.to_thread(self.set, key, value)
 
     async def adelete(self, key: Any) -> bool:
         """
@@ -221,7 +300,6 @@ class FileCache:
 # =============================================================================
 
 if __name__ == "__main__":
-    import asyncio
     import tempfile
 
     # Create a temporary cache directory for demo, use persistent path for real usage
@@ -238,7 +316,7 @@ if __name__ == "__main__":
         print(f"Sync - Retrieved: {retrieved}")
         print(f"Sync - Match: {value == retrieved}")
 
-        # Async usage (if aiofiles is available)
+        # Async usage
         async def async_demo():
             key2 = {"user_id": 43, "query": "news"}
             value2 = {"headlines": ["Story 1", "Story 2"]}
@@ -249,7 +327,4 @@ if __name__ == "__main__":
             print(f"Async - Retrieved: {retrieved2}")
             print(f"Async - Match: {value2 == retrieved2}")
 
-        if aiofiles is not None:
-            asyncio.run(async_demo())
-        else:
-            print("\n(Skipping async demo - install aiofiles for async support)")
+        asyncio.run(async_demo())
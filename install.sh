@@ -4,4 +4,4 @@ set -e
 cd "$(dirname "$0")"
 
 python3 -m venv .venv
-.venv/bin/pip install anthropic
+.venv/bin/pip install anthropic "httpx2[http2]" msgspec blake3 uvloop
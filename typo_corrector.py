@@ -1,17 +1,28 @@
 #!/usr/bin/env python3
 """
 Simple typo correction script using Claude API.
+
+Uses uvloop for the event loop when it is installed (pip install uvloop).
 """
 
 import argparse
 import asyncio
 import os
+import re
 from pathlib import Path
 
 import anthropic
+import httpx2
+from anthropic.lib.streaming import AsyncMessageStream
 
 from file_cache import FileCache
 
+# Optional faster event loop
+try:
+    import uvloop
+except ImportError:
+    uvloop = None  # type: ignore[assignment]
+
 # Setup cache in ~/.cache/typo_corrector
 CACHE_DIR = Path.home() / ".cache" / "typo_corrector"
 cache = FileCache(CACHE_DIR)
@@ -36,53 +47,119 @@ Your reliable knowledge cutoff date - the date past which you cannot answer ques
 ===END===
 """.strip()
 
-MODEL = "claude-opus-4-6"
-
-semaphore = asyncio.Semaphore(100)
-
-
-def individual_split_by(text: str, delimiter: str) -> list[str]:
-    parts = text.split(delimiter)
-
-    if len(parts) == 1:
-        return [text]
-
-    result = [parts[0] + delimiter + parts[1]]
-
-    for part in parts[2:]:
-        result.append(delimiter + part)
-
-    return result
-
-
-def split_by(items: list[tuple[str, str]], splitter: str) -> list[tuple[str, str]]:
-    new = []
-    for item in items:
-        new += [(item[0], x) for x in individual_split_by(item[1], splitter)]
-    return new
-
-
-def split_all_by(items: list[tuple[str, str]], splitters: list[str]) -> list[tuple[str, str]]:
-    for splitter in splitters:
-        items = split_by(items, splitter)
-    return items
+# PROMPT split around its only placeholder, so sections can be inserted by concatenation
+PROMPT_PREFIX, PROMPT_SUFFIX = PROMPT.split("{text}")
 
+MODEL = "claude-opus-4-6"
 
-async def fix_section(client: anthropic.AsyncAnthropic, name: str, text: str) -> tuple[str, str, str]:
+# Request parameters shared by every section
+BASE_KWARGS = {
+    "model": MODEL,
+    "system": SYSTEM_PROMPT,
+    "max_tokens": 32000,
+    "temperature": 0,
+}
+
+# Hash of everything in a request except the section text. Paired with the text it
+# identifies a section's cache entry without serializing the whole prompt per section.
+STATIC_KEY_HASH = cache.hash_key({**BASE_KWARGS, "prompt": PROMPT})
+
+MAX_CONCURRENCY = 100
+
+HEADER_RE = re.compile(r"\n(#{1,6}) ")
+
+# Error messages that are worth retrying (rate limits, overload, timeouts, 5xx)
+RETRYABLE_RE = re.compile(r"rate|overloaded|timeout|timed out|dropped connection|429|5(?:00|02|03|04|29)", re.IGNORECASE)
+
+REWRITE_RE = re.compile(r"===REWRITE START===\s*(.*?)\s*===REWRITE END===", re.DOTALL)
+
+
+def split_by_headers(text: str) -> list[str]:
+    """
+    Split markdown text into sections at its headers in a single scan.
+
+    Within the chunk delimited by shallower headers, the first header of each
+    level stays attached to the text before it and every later one starts a new
+    section. Each header keeps its preceding newline.
+    """
+    seen_level = [False] * 7
+    offsets = [0]
+    for match in HEADER_RE.finditer(text):
+        level = len(match.group(1))
+        if seen_level[level]:
+            offsets.append(match.start())
+            seen_level[level + 1:] = [False] * (6 - level)
+        seen_level[level] = True
+    offsets.append(len(text))
+    return [text[start:end] for start, end in zip(offsets, offsets[1:])]
+
+
+class AdaptiveLimiter:
+    """
+    Async concurrency limiter whose limit follows the API's rate-limit headers.
+
+    After each success the limit is set to the remaining request budget the API
+    reports (capped at max_limit, or grown by one if the header is missing); on
+    a rate-limit error it is halved. Create it inside the running event loop.
+    """
+
+    def __init__(self, max_limit: int):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+    async def __aexit__(self, *exc_info) -> None:
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    async def _set_limit(self, limit: int) -> None:
+        async with self._condition:
+            self.limit = max(1, min(self.max_limit, limit))
+            self._condition.notify_all()
+
+    async def on_success(self, remaining: str | None) -> None:
+        """Match the limit to the `anthropic-ratelimit-requests-remaining` header value."""
+        await self._set_limit(int(remaining) if remaining is not None else self.limit + 1)
+
+    async def on_rate_limit(self) -> None:
+        """Halve the limit after a rate-limit error."""
+        await self._set_limit(self.limit // 2)
+
+
+async def read_stream(stream: AsyncMessageStream) -> tuple[str, str | None]:
+    """Collect the text deltas of a message stream as they arrive, plus its stop reason."""
+    chunks: list[str] = []
+    stop_reason = None
+    async for event in stream:
+        if event.type == "text":
+            chunks.append(event.text)
+        elif event.type == "message_delta":
+            stop_reason = event.delta.stop_reason
+    return "".join(chunks), stop_reason
+
+
+async def fix_section(
+    client: anthropic.AsyncAnthropic, limiter: AdaptiveLimiter, name: str, text: str
+) -> tuple[str, str, str]:
     """Fix typos in a section, using cache."""
-    kwargs = {
-        "model": MODEL,
-        "system": SYSTEM_PROMPT,
-        "max_tokens": 32000,
-        "temperature": 0,
-        "messages": [{"role": "user", "content": PROMPT.format(text=text)}],
-    }
-
-    cached = cache.get(kwargs)
+    key_hash = cache.hash_key((STATIC_KEY_HASH, text))
+    cached = cache.get_by_hash(key_hash)
     if cached is not None:
         return name, cached, text.strip()
 
-    async with semaphore:
+    kwargs = {
+        **BASE_KWARGS,
+        "messages": [{"role": "user", "content": PROMPT_PREFIX + text + PROMPT_SUFFIX}],
+    }
+
+    async with limiter:
         initial_delay = 0.5
         max_delay = 10.0
         max_retries = 10
@@ -91,26 +168,18 @@ async def fix_section(client: anthropic.AsyncAnthropic, name: str, text: str) ->
         for attempt in range(max_retries):
             try:
                 async with client.messages.stream(**kwargs) as stream:
-                    response = await asyncio.wait_for(
-                        stream.get_final_message(),
-                        timeout=1000,
-                    )
+                    out, stop_reason = await read_stream(stream)
+                    await limiter.on_success(stream.response.headers.get("anthropic-ratelimit-requests-remaining"))
                 break
-            except asyncio.TimeoutError:
+            except (anthropic.APITimeoutError, httpx2.TimeoutException):
                 this_delay = min(delay, max_delay)
                 print(f"Timeout on attempt {attempt + 1}/{max_retries} for {name}, retrying with {this_delay=}...")
                 await asyncio.sleep(this_delay)
                 delay *= 2
             except Exception as e:
-                err_string = str(e).lower()
-                if (
-                    "rate" in err_string
-                    or "overloaded" in err_string
-                    or "timeout" in err_string
-                    or "timed out" in err_string
-                    or "dropped connection" in err_string
-                    or any(code in err_string for code in ["429", "500", "502", "503", "504", "529"])
-                ):
+                if isinstance(e, anthropic.RateLimitError):
+                    await limiter.on_rate_limit()
+                if RETRYABLE_RE.search(str(e)):
                     this_delay = min(delay, max_delay)
                     print(f"Retryable error on attempt {attempt + 1}/{max_retries} for {name}: {e} ({type(e).__name__}, {this_delay=})")
                     await asyncio.sleep(this_delay)
@@ -120,15 +189,13 @@ async def fix_section(client: anthropic.AsyncAnthropic, name: str, text: str) ->
         else:
             raise RuntimeError(f"Max retries exceeded for section: {name}")
 
-    out = response.content[0].text
+    assert stop_reason != "max_tokens", f"Max tokens hit for section: {name}, {text[:100]}"
+    match = REWRITE_RE.search(out)
+    assert match is not None, f"Missing REWRITE markers in output for {name}"
 
-    assert response.stop_reason != "max_tokens", f"Max tokens hit for section: {name}, {text[:100]}"
-    assert "===REWRITE START===" in out, f"Missing REWRITE START in output for {name}"
-    assert "===REWRITE END===" in out, f"Missing REWRITE END in output for {name}"
+    parsed_out = match.group(1)
 
-    parsed_out = out.split("===REWRITE START===")[1].split("===REWRITE END===")[0].strip()
-
-    cache.set(kwargs, parsed_out)
+    cache.set_by_hash(key_hash, parsed_out)
 
     return name, parsed_out, text.strip()
 
@@ -151,21 +218,27 @@ async def main():
     # Only split by markdown headers for .md/.markdown files, unless --no-split is set
     is_markdown = input_path.suffix.lower() in (".md", ".markdown")
     if is_markdown and not args.no_split:
-        sections = split_all_by(
-            [("section", all_text)],
-            ["\n# ", "\n## ", "\n### ", "\n#### ", "\n##### ", "\n###### "]
-        )
+        sections = [("section", text) for text in split_by_headers(all_text)]
     else:
         sections = [("section", all_text)]
 
-    client = anthropic.AsyncAnthropic()
+    # Keep enough warm connections for every concurrent request; HTTP/2
+    # multiplexes the streams over fewer TCP+TLS connections. The read timeout
+    # bounds how long a stream may go without receiving data.
+    client = anthropic.AsyncAnthropic(
+        http_client=anthropic.DefaultAsyncHttpxClient(
+            limits=httpx2.Limits(max_connections=128, max_keepalive_connections=128, keepalive_expiry=60.0),
+            http2=True,
+        ),
+        timeout=httpx2.Timeout(connect=10.0, read=1000.0, write=60.0, pool=10.0),
+    )
+
+    limiter = AdaptiveLimiter(MAX_CONCURRENCY)
 
-    tasks = [fix_section(client, name, text) for name, text in sections]
+    tasks = [fix_section(client, limiter, name, text) for name, text in sections]
     all_out = await asyncio.gather(*tasks)
 
-    total_new = ""
-    for _, out, _ in all_out:
-        total_new += out + "\n\n"
+    total_new = "\n\n".join(out for _, out, _ in all_out)
 
     # Remove trailing newlines to match original style better
     total_new = total_new.rstrip() + "\n"
@@ -186,4 +259,5 @@ async def main():
 
 
 if __name__ == "__main__":
-    exit(asyncio.run(main()))
+    run = uvloop.run if uvloop is not None else asyncio.run
+    exit(run(main()))